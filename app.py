@@ -1,14 +1,20 @@
 import streamlit as st
+from streamlit_autorefresh import st_autorefresh
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
 import numpy as np
 import requests
-from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta
 import json
+import os
 import time
 
+try:
+    import redis
+except ImportError:  # Redis opzionale: senza, resta solo la cache di Streamlit
+    redis = None
+
 # ===== ORACLE DASHBOARD - STREAMLIT CLOUD VERSION =====
 # Dashboard autonomo per Oracle Trading System
 # Ottimizzato per deployment su Streamlit Cloud
@@ -20,28 +26,119 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def _get_http_session():
+    """Sessione HTTP condivisa: mantiene viva la connessione verso CoinGecko tra i rerun"""
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.2))
+    )
+    return session
+
+# Cache Redis condivisa tra repliche (attiva solo se REDIS_URL è impostato)
+MARKET_CACHE_KEY = "mkt:prices"
+MARKET_STALE_KEY = "mkt:prices:stale"
+MARKET_CACHE_TTL = 300
+REDIS_RETRY_AFTER = 60  # Dopo un errore di connessione Redis viene ignorato per 1 minuto
+
+@st.cache_resource
+def _get_redis_state():
+    """Client Redis e stato del circuit breaker, condivisi tra i rerun"""
+    client = None
+    if redis is not None and os.getenv("REDIS_URL"):
+        client = redis.Redis.from_url(
+            os.environ["REDIS_URL"], socket_connect_timeout=1, socket_timeout=1
+        )
+    return {'client': client, 'down_until': 0.0}
+
+def _redis_client():
+    """Client Redis, None se non configurato o in pausa dopo un errore"""
+    state = _get_redis_state()
+    if state['client'] is None or time.time() < state['down_until']:
+        return None
+    return state['client']
+
+def _redis_mark_down():
+    """Apre il circuit breaker: Redis non viene contattato per REDIS_RETRY_AFTER secondi"""
+    _get_redis_state()['down_until'] = time.time() + REDIS_RETRY_AFTER
+
 # ===== UTILITY FUNCTIONS =====
-@st.cache_data(ttl=300)  # Cache per 5 minuti
+def _redis_get(key):
+    """Legge un valore JSON da Redis, None se assente o non raggiungibile"""
+    client = _redis_client()
+    if client is None:
+        return None
+    try:
+        cached = client.get(key)
+        return json.loads(cached) if cached else None
+    except redis.RedisError:
+        _redis_mark_down()
+        return None
+    except ValueError:
+        # Valore non JSON sotto la chiave
+        return None
+
+def _redis_store_prices(prices):
+    """Salva i prezzi in Redis: copia con TTL e copia stale per le interruzioni API"""
+    client = _redis_client()
+    if client is None:
+        return
+    try:
+        payload = json.dumps(prices)
+        client.setex(MARKET_CACHE_KEY, MARKET_CACHE_TTL, payload)
+        client.set(MARKET_STALE_KEY, payload)
+    except redis.RedisError:
+        _redis_mark_down()
+
+def _redis_invalidate_prices():
+    """Rimuove i prezzi condivisi, così il prossimo caricamento interroga CoinGecko"""
+    client = _redis_client()
+    if client is None:
+        return
+    try:
+        client.delete(MARKET_CACHE_KEY)
+    except redis.RedisError:
+        _redis_mark_down()
+
 def load_market_data():
+    """Carica dati di mercato: prima la copia condivisa in Redis, poi la cache locale"""
+    cached = _redis_get(MARKET_CACHE_KEY)
+    if cached is not None:
+        return cached
+    return fetch_market_data()
+
+@st.cache_data(ttl=MARKET_CACHE_TTL)  # Cache per 5 minuti
+def fetch_market_data():
     """Carica dati di mercato reali da API"""
     try:
         symbols = ['bitcoin', 'ethereum', 'binancecoin', 'cardano', 'solana']
         prices = {}
         
-        for symbol in symbols:
-            url = f"https://api.coingecko.com/api/v3/simple/price?ids={symbol}&vs_currencies=usd&include_24hr_change=true"
-            response = requests.get(url, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
+        # Una sola richiesta per tutti i simboli (CoinGecko accetta ids multipli)
+        url = f"https://api.coingecko.com/api/v3/simple/price?ids={','.join(symbols)}&vs_currencies=usd&include_24hr_change=true"
+        response = _get_http_session().get(url, timeout=5)
+        if response.status_code == 200:
+            data = response.json()
+            for symbol in symbols:
                 if symbol in data:
                     prices[symbol.upper()] = {
                         'price': data[symbol]['usd'],
                         'change_24h': data[symbol].get('usd_24h_change', 0)
                     }
-        return prices
     except Exception:
-        # Fallback con dati simulati
-        return generate_sample_market_data()
+        # Fallback: ultimi prezzi reali in Redis, altrimenti dati simulati
+        stale = _redis_get(MARKET_STALE_KEY)
+        return stale if stale is not None else generate_sample_market_data()
+    
+    if not prices:
+        # Risposta non-200 (es. 429): ultimi prezzi reali in Redis se presenti,
+        # altrimenti nessun dato (la pagina mostra l'avviso)
+        stale = _redis_get(MARKET_STALE_KEY)
+        return stale if stale is not None else prices
+    
+    _redis_store_prices(prices)
+    return prices
 
 def generate_sample_market_data():
     """Genera dati di mercato simulati"""
@@ -58,43 +155,32 @@ def generate_sample_market_data():
         }
     return prices
 
+@st.cache_data(ttl=60)  # Cache per 1 minuto
 def generate_sample_performance_data(days=30):
     """Genera dati di performance simulati"""
+    # Seed per minuto: stessi dati per tutta la durata della cache
+    rng = np.random.default_rng(int(time.time() // 60))
     dates = pd.date_range(start=datetime.now() - timedelta(days=days), end=datetime.now(), freq='H')
-    
-    # Simula performance AI e RL
-    ai_balance = 10000
-    rl_balance = 10000
-    
-    data = []
-    for date in dates:
-        # AI performance (più stabile)
-        ai_change = np.random.normal(0.001, 0.02)
-        ai_balance *= (1 + ai_change)
-        
-        # RL performance (più volatile ma potenzialmente migliore)
-        rl_change = np.random.normal(0.002, 0.05)
-        rl_balance *= (1 + rl_change)
-        
-        data.extend([
-            {
-                'timestamp': date,
-                'agent': 'AI',
-                'balance_usdt': ai_balance,
-                'roi_eff': (ai_balance - 10000) / 10000 * 100,
-                'trade_count': np.random.randint(0, 5)
-            },
-            {
-                'timestamp': date,
-                'agent': 'RL',
-                'balance_usdt': rl_balance,
-                'roi_eff': (rl_balance - 10000) / 10000 * 100,
-                'trade_count': np.random.randint(0, 8)
-            }
-        ])
-    
-    return pd.DataFrame(data)
+    n = len(dates)
+    
+    # Simula performance AI e RL (vettorizzato: rendimenti orari -> prodotto cumulato)
+    # AI performance (più stabile)
+    ai_balance = 10000 * np.cumprod(1 + rng.normal(0.001, 0.02, n))
+    # RL performance (più volatile ma potenzialmente migliore)
+    rl_balance = 10000 * np.cumprod(1 + rng.normal(0.002, 0.05, n))
+    
+    # Righe alternate AI/RL per ogni timestamp, come nel layout originale
+    balances = np.column_stack([ai_balance, rl_balance]).ravel()
+    
+    return pd.DataFrame({
+        'timestamp': np.repeat(dates, 2),
+        'agent': pd.Categorical(np.tile(['AI', 'RL'], n), categories=['AI', 'RL']),
+        'balance_usdt': balances,
+        'roi_eff': (balances - 10000) / 10000 * 100,
+        'trade_count': rng.integers(0, np.tile([5, 8], n))
+    }).set_index('timestamp').sort_index()
 
+@st.cache_data(ttl=30)  # Allineato all'auto refresh
 def calculate_system_metrics():
     """Calcola metriche di sistema simulate"""
     return {
@@ -108,13 +194,23 @@ def calculate_system_metrics():
     }
 
 # ===== CHART FUNCTIONS =====
-def create_performance_chart(df, timeframe="7D"):
+def _df_cache_key(df):
+    """Chiave di cache leggera per un DataFrame: righe e ultimo timestamp"""
+    return hash((len(df), str(df.index[-1]) if len(df) else None))
+
+# Plotly importato solo nelle funzioni grafico: la Main Dashboard non lo carica.
+# Figure in cache_resource: condivise senza copia (nessuno le modifica dopo il return)
+@st.cache_resource(ttl=60, hash_funcs={pd.DataFrame: _df_cache_key})
+def create_performance_chart(ai_df, rl_df, timeframe="7D"):
     """Crea grafico performance AI vs RL"""
-    if df.empty:
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    
+    if ai_df.empty and rl_df.empty:
         return go.Figure()
     
-    # Filtra per timeframe
-    now = datetime.now(timezone.utc)
+    # Filtra per timeframe (orario locale naive, come i timestamp generati)
+    now = datetime.now()
     if timeframe == "1D":
         cutoff = now - timedelta(days=1)
     elif timeframe == "7D":
@@ -124,7 +220,9 @@ def create_performance_chart(df, timeframe="7D"):
     else:
         cutoff = now - timedelta(hours=24)
     
-    df_filtered = df[df['timestamp'] > cutoff]
+    # Indice temporale ordinato: slicing con ricerca binaria invece di una maschera
+    ai_data = ai_df.loc[cutoff:]
+    rl_data = rl_df.loc[cutoff:]
     
     fig = make_subplots(
         rows=2, cols=2,
@@ -134,35 +232,33 @@ def create_performance_chart(df, timeframe="7D"):
     )
     
     # Balance evolution
-    ai_data = df_filtered[df_filtered['agent'] == 'AI']
-    rl_data = df_filtered[df_filtered['agent'] == 'RL']
-    
     fig.add_trace(
-        go.Scatter(x=ai_data['timestamp'], y=ai_data['balance_usdt'], 
-                  name='AI Balance', line=dict(color='blue')),
+        go.Scattergl(x=ai_data.index, y=ai_data['balance_usdt'], 
+                     name='AI Balance', line=dict(color='blue')),
         row=1, col=1
     )
     fig.add_trace(
-        go.Scatter(x=rl_data['timestamp'], y=rl_data['balance_usdt'], 
-                  name='RL Balance', line=dict(color='red')),
+        go.Scattergl(x=rl_data.index, y=rl_data['balance_usdt'], 
+                     name='RL Balance', line=dict(color='red')),
         row=1, col=1
     )
     
     # ROI efficiency
     fig.add_trace(
-        go.Scatter(x=ai_data['timestamp'], y=ai_data['roi_eff'], 
-                  name='AI ROI', line=dict(color='green')),
+        go.Scattergl(x=ai_data.index, y=ai_data['roi_eff'], 
+                     name='AI ROI', line=dict(color='green')),
         row=1, col=2
     )
     fig.add_trace(
-        go.Scatter(x=rl_data['timestamp'], y=rl_data['roi_eff'], 
-                  name='RL ROI', line=dict(color='orange')),
+        go.Scattergl(x=rl_data.index, y=rl_data['roi_eff'], 
+                     name='RL ROI', line=dict(color='orange')),
         row=1, col=2
     )
     
     # Trade volume
-    ai_trades = ai_data.groupby(ai_data['timestamp'].dt.date)['trade_count'].sum()
-    rl_trades = rl_data.groupby(rl_data['timestamp'].dt.date)['trade_count'].sum()
+    # Raggruppa per giorno su datetime64[D] (chiavi intere, non oggetti date)
+    ai_trades = ai_data['trade_count'].groupby(ai_data.index.values.astype('datetime64[D]')).sum()
+    rl_trades = rl_data['trade_count'].groupby(rl_data.index.values.astype('datetime64[D]')).sum()
     
     fig.add_trace(
         go.Bar(x=ai_trades.index, y=ai_trades.values, name='AI Trades', marker_color='blue'),
@@ -184,11 +280,17 @@ def create_performance_chart(df, timeframe="7D"):
         row=2, col=2
     )
     
-    fig.update_layout(height=600, title_text=f"Oracle Performance Analytics ({timeframe})")
+    fig.update_layout(
+        height=600,
+        title_text=f"Oracle Performance Analytics ({timeframe})",
+        transition={'duration': 0}  # Nessuna animazione ad ogni rerun
+    )
     return fig
 
 def create_market_overview_chart(market_data):
     """Crea grafico overview mercato"""
+    import plotly.graph_objects as go
+    
     if not market_data:
         return go.Figure()
     
@@ -212,30 +314,34 @@ def create_market_overview_chart(market_data):
         title="Crypto Market Overview - 24h Changes",
         xaxis_title="Cryptocurrency",
         yaxis_title="24h Change (%)",
-        height=400
+        height=400,
+        transition={'duration': 0}
     )
     
     return fig
 
-def create_risk_analysis_chart(df):
+@st.cache_resource(ttl=60, hash_funcs={pd.DataFrame: _df_cache_key})
+def create_risk_analysis_chart(ai_df, rl_df):
     """Crea grafico analisi rischio"""
-    if df.empty or 'balance_usdt' not in df.columns:
+    import plotly.graph_objects as go
+    
+    if (ai_df.empty and rl_df.empty) or 'balance_usdt' not in ai_df.columns:
         return go.Figure()
     
-    # Calcola drawdown per AI e RL
-    ai_data = df[df['agent'] == 'AI']['balance_usdt']
-    rl_data = df[df['agent'] == 'RL']['balance_usdt']
+    # Calcola drawdown per AI e RL (massimo cumulato direttamente sull'array)
+    ai_data = ai_df['balance_usdt'].to_numpy()
+    rl_data = rl_df['balance_usdt'].to_numpy()
     
-    ai_peak = ai_data.expanding().max()
+    ai_peak = np.maximum.accumulate(ai_data)
     ai_drawdown = (ai_data - ai_peak) / ai_peak * 100
     
-    rl_peak = rl_data.expanding().max()
+    rl_peak = np.maximum.accumulate(rl_data)
     rl_drawdown = (rl_data - rl_peak) / rl_peak * 100
     
     fig = go.Figure()
     
-    fig.add_trace(go.Scatter(
-        x=df[df['agent'] == 'AI']['timestamp'],
+    fig.add_trace(go.Scattergl(
+        x=ai_df.index,
         y=ai_drawdown,
         fill='tozeroy',
         name='AI Drawdown',
@@ -243,8 +349,8 @@ def create_risk_analysis_chart(df):
         fillcolor='rgba(0,0,255,0.3)'
     ))
     
-    fig.add_trace(go.Scatter(
-        x=df[df['agent'] == 'RL']['timestamp'],
+    fig.add_trace(go.Scattergl(
+        x=rl_df.index,
         y=rl_drawdown,
         fill='tozeroy',
         name='RL Drawdown',
@@ -256,7 +362,8 @@ def create_risk_analysis_chart(df):
         title="Portfolio Drawdown Analysis",
         xaxis_title="Time",
         yaxis_title="Drawdown (%)",
-        height=400
+        height=400,
+        transition={'duration': 0}
     )
     
     return fig
@@ -281,13 +388,31 @@ def main():
     timeframe = st.sidebar.selectbox("Timeframe", ["1D", "7D", "30D"], index=1)
     auto_refresh = st.sidebar.checkbox("Auto Refresh (30s)", value=False)
     
+    if auto_refresh:
+        # Rerun pilotato dal browser, non blocca il thread dello script
+        st_autorefresh(interval=30_000, key="refresh")
+    
     if st.sidebar.button("🔄 Refresh Data"):
-        st.cache_data.clear()
+        # Invalida solo i dati di mercato (anche la copia condivisa in Redis),
+        # le altre cache scadono da sole
+        _redis_invalidate_prices()
+        fetch_market_data.clear()
         st.rerun()
     
     # Load data
     market_data = load_market_data()
-    performance_df = generate_sample_performance_data()
+    # La pagina Performance genera solo l'orizzonte del timeframe (serie relativa alla
+    # finestra); le altre pagine condividono lo stesso storico di 30 giorni
+    if page == "📊 Performance Charts":
+        performance_days = {'1D': 1, '7D': 7, '30D': 30}[timeframe]
+    else:
+        performance_days = 30
+    performance_df = generate_sample_performance_data(days=performance_days)
+    
+    # Split per agente una sola volta, riutilizzato da tutte le pagine
+    _groups = dict(tuple(performance_df.groupby('agent', sort=False, observed=True)))
+    ai_df = _groups.get('AI', performance_df.iloc[:0])
+    rl_df = _groups.get('RL', performance_df.iloc[:0])
     metrics = calculate_system_metrics()
     
     # === MAIN DASHBOARD ===
@@ -318,15 +443,13 @@ def main():
         # Performance overview
         st.header("💰 Performance Overview")
         
-        if not performance_df.empty:
-            recent_data = performance_df.tail(100)  # Last 100 records
-            
+        if not ai_df.empty and not rl_df.empty:
             col1, col2 = st.columns(2)
             
             with col1:
                 # Current balances
-                ai_balance = recent_data[recent_data['agent'] == 'AI']['balance_usdt'].iloc[-1]
-                rl_balance = recent_data[recent_data['agent'] == 'RL']['balance_usdt'].iloc[-1]
+                ai_balance = ai_df['balance_usdt'].iloc[-1]
+                rl_balance = rl_df['balance_usdt'].iloc[-1]
                 
                 st.subheader("Current Balances")
                 st.metric("AI Agent", f"${ai_balance:,.2f}", f"{((ai_balance-10000)/10000*100):+.2f}%")
@@ -334,8 +457,8 @@ def main():
             
             with col2:
                 # ROI comparison
-                ai_roi = recent_data[recent_data['agent'] == 'AI']['roi_eff'].iloc[-1]
-                rl_roi = recent_data[recent_data['agent'] == 'RL']['roi_eff'].iloc[-1]
+                ai_roi = ai_df['roi_eff'].iloc[-1]
+                rl_roi = rl_df['roi_eff'].iloc[-1]
                 
                 st.subheader("ROI Efficiency")
                 st.metric("AI ROI", f"{ai_roi:.2f}%")
@@ -363,30 +486,27 @@ def main():
         st.header(f"📈 Performance Analysis ({timeframe})")
         
         if not performance_df.empty:
-            fig = create_performance_chart(performance_df, timeframe)
+            fig = create_performance_chart(ai_df, rl_df, timeframe)
             st.plotly_chart(fig, use_container_width=True)
             
             # Statistics
-            st.subheader("📊 Performance Statistics")
-            
-            ai_data = performance_df[performance_df['agent'] == 'AI']
-            rl_data = performance_df[performance_df['agent'] == 'RL']
+            st.subheader(f"📊 Performance Statistics ({timeframe} window)")
             
             col1, col2 = st.columns(2)
             
             with col1:
                 st.write("**AI Agent Statistics**")
-                st.write(f"- Average Balance: ${ai_data['balance_usdt'].mean():,.2f}")
-                st.write(f"- Max Balance: ${ai_data['balance_usdt'].max():,.2f}")
-                st.write(f"- Total Trades: {ai_data['trade_count'].sum()}")
-                st.write(f"- Volatility: {ai_data['balance_usdt'].std():.2f}")
+                st.write(f"- Average Balance: ${ai_df['balance_usdt'].mean():,.2f}")
+                st.write(f"- Max Balance: ${ai_df['balance_usdt'].max():,.2f}")
+                st.write(f"- Total Trades: {ai_df['trade_count'].sum()}")
+                st.write(f"- Volatility: {ai_df['balance_usdt'].std():.2f}")
             
             with col2:
                 st.write("**RL Agent Statistics**")
-                st.write(f"- Average Balance: ${rl_data['balance_usdt'].mean():,.2f}")
-                st.write(f"- Max Balance: ${rl_data['balance_usdt'].max():,.2f}")
-                st.write(f"- Total Trades: {rl_data['trade_count'].sum()}")
-                st.write(f"- Volatility: {rl_data['balance_usdt'].std():.2f}")
+                st.write(f"- Average Balance: ${rl_df['balance_usdt'].mean():,.2f}")
+                st.write(f"- Max Balance: ${rl_df['balance_usdt'].max():,.2f}")
+                st.write(f"- Total Trades: {rl_df['trade_count'].sum()}")
+                st.write(f"- Volatility: {rl_df['balance_usdt'].std():.2f}")
         else:
             st.warning("No performance data available")
     
@@ -402,11 +522,18 @@ def main():
             st.subheader("Market Data")
             market_df = pd.DataFrame.from_dict(market_data, orient='index')
             market_df.index.name = 'Symbol'
-            market_df['Price'] = market_df['price'].apply(lambda x: f"${x:,.2f}")
-            market_df['24h Change'] = market_df['change_24h'].apply(lambda x: f"{x:+.2f}%")
-            market_df = market_df[['Price', '24h Change']]
             
-            st.dataframe(market_df, use_container_width=True)
+            # Valori numerici formattati lato client (ordinabili nella tabella).
+            # Nota: il formato printf non ha separatore delle migliaia ($45000.00);
+            # i preset "dollar"/"localized" non esistono in streamlit 1.28
+            st.dataframe(
+                market_df[['price', 'change_24h']],
+                column_config={
+                    "price": st.column_config.NumberColumn("Price", format="$%.2f"),
+                    "change_24h": st.column_config.NumberColumn("24h Change", format="%+.2f%%")
+                },
+                use_container_width=True
+            )
         else:
             st.warning("Market data not available")
     
@@ -416,11 +543,8 @@ def main():
         
         if not performance_df.empty:
             # Risk metrics
-            ai_data = performance_df[performance_df['agent'] == 'AI']
-            rl_data = performance_df[performance_df['agent'] == 'RL']
-            
-            ai_returns = ai_data['balance_usdt'].pct_change().dropna()
-            rl_returns = rl_data['balance_usdt'].pct_change().dropna()
+            ai_returns = ai_df['balance_usdt'].pct_change().dropna()
+            rl_returns = rl_df['balance_usdt'].pct_change().dropna()
             
             col1, col2 = st.columns(2)
             
@@ -447,16 +571,11 @@ def main():
                     st.metric("VaR (5%)", f"{rl_var:.2f}%")
             
             # Drawdown chart
-            fig_risk = create_risk_analysis_chart(performance_df)
+            fig_risk = create_risk_analysis_chart(ai_df, rl_df)
             st.plotly_chart(fig_risk, use_container_width=True)
         else:
             st.warning("Insufficient data for risk analysis")
     
-    # Auto refresh
-    if auto_refresh:
-        time.sleep(30)
-        st.rerun()
-    
     # Footer
     st.sidebar.markdown("---")
     st.sidebar.markdown("**Oracle Dashboard v1.0**")